@@ -6,7 +6,23 @@ NO AUTHENTICATION OR OTP REQUIRED - Scrapes public data only.
 
 import asyncio
 import aiohttp
-from bs4 import BeautifulSoup
+import lxml.html
+import orjson
+try:
+    # C lexbor engine, much faster than lxml for this page; optional
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+try:
+    # libuv event loop, cheaper per I/O event than asyncio's; optional
+    import uvloop
+except ImportError:
+    uvloop = None
+try:
+    # Lets aiohttp decode Brotli responses; optional
+    import brotli
+except ImportError:
+    brotli = None
 from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application,
@@ -19,11 +35,24 @@ import os
 from dotenv import load_dotenv
 from datetime import datetime
 import logging
-from typing import Dict, List, Optional
+import logging.handlers
+import queue
+from typing import Callable, Dict, List, Optional, Set, Tuple
 from dataclasses import dataclass, field
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
 import sys
-import json
+import codecs
+import hashlib
+import heapq
+import math
+import operator
+import random
+import re
+import time
 from pathlib import Path
+from urllib.parse import urlparse
 
 # =============================================================================
 # CONFIGURATION
@@ -33,15 +62,26 @@ load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 VISA_SLOTS_URL = os.getenv("VISA_SLOTS_URL", "https://visaslots.info/")
+# Public https URL for Telegram to push updates to; polling is used if unset
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
 
 # Logging Configuration
+# Records are only enqueued on the event loop; log_listener's thread does the
+# actual stdout/file writes. It is started in main().
+_log_queue: queue.Queue = queue.Queue(-1)
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO,
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler('visa_bot.log')
-    ]
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    handlers=[logging.handlers.QueueHandler(_log_queue)]
+)
+# PTB's httpx client logs every getUpdates/sendMessage at INFO, bot token included
+logging.getLogger("httpx").setLevel(logging.WARNING)
+log_listener = logging.handlers.QueueListener(
+    _log_queue,
+    logging.StreamHandler(sys.stdout),
+    logging.FileHandler('visa_bot.log')
 )
 logger = logging.getLogger(__name__)
 
@@ -57,20 +97,85 @@ INTERVALS = {
     "30 min": 1800,
     "60 min": 3600
 }
+# Users due within half a tick of each other are checked, and fetched for,
+# together, so their schedules settle onto shared wakeups
+POLL_TICK = math.gcd(*INTERVALS.values())
+
+# Static menu keyboards, built once and shared by every handler
+VISA_KEYBOARD = InlineKeyboardMarkup(
+    [[InlineKeyboardButton(visa, callback_data=f"visa_{visa}")] for visa in VISA_TYPES]
+)
+CITY_KEYBOARD = InlineKeyboardMarkup(
+    [[InlineKeyboardButton(city, callback_data=f"city_{city}")] for city in CITIES]
+)
+CONSULATE_TYPE_KEYBOARD = InlineKeyboardMarkup(
+    [[InlineKeyboardButton(t, callback_data=f"type_{t}")] for t in CONSULATE_TYPES]
+)
+YEAR_KEYBOARD = InlineKeyboardMarkup(
+    [[InlineKeyboardButton(y, callback_data=f"year_{y}")] for y in YEAR_OPTIONS]
+)
+INTERVAL_KEYBOARD = InlineKeyboardMarkup(
+    [[InlineKeyboardButton(i, callback_data=f"interval_{i}")] for i in INTERVALS]
+)
+START_KEYBOARD = InlineKeyboardMarkup(
+    [[InlineKeyboardButton("🚀 Start Monitoring", callback_data="start_alerts")]]
+)
 
 # Constants
 MAX_RETRIES = 3
 RETRY_DELAY = 5
+MAX_RETRY_BACKOFF = 30
+MAX_NOTIFIED_SLOTS = 50  # Slot fingerprints remembered per user for 🆕 vs 🔄 alerts
+SAVE_DEBOUNCE = 5  # Seconds to coalesce preference changes into one save
 REQUEST_TIMEOUT = 30
-RATE_LIMIT_DELAY = 2
+MAX_PAGE_BYTES = 5 * 1024 * 1024  # Far above the real page, caps memory per fetch
+PER_CHAT_SEND_INTERVAL = 1.0  # Telegram allows ~1 message/sec per chat
+GLOBAL_SEND_INTERVAL = 1 / 30  # ...and ~30 messages/sec across all chats
+# Replies and alerts share PTB's default 256-connection pool, getUpdates
+# keeps its own single long-poll connection. Only the waits are raised.
+TELEGRAM_POOL_TIMEOUT = 20.0
+MAX_MESSAGE_LENGTH = 4000  # Under Telegram's 4096 character limit
+MAX_CONCURRENT_CHECKS = int(os.getenv("MAX_CONCURRENT_CHECKS", "50"))  # Per-user checks in flight
+MAX_CONCURRENT_SENDS = 25  # In-flight alert sends, far below the pool so replies always get a connection
+GET_UPDATES_POOL_TIMEOUT = 60.0
 DATA_DIR = Path("data")
 DATA_DIR.mkdir(exist_ok=True)
 
+# Realistic browser user agents, one is picked per request
+USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:122.0) Gecko/20100101 Firefox/122.0",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.2.1 Safari/605.1.15",
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36"
+]
+
+BROWSER_HEADERS = {
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.9",
+    # Only ask for br when it can be decoded, or the fetch would fail
+    "Accept-Encoding": "gzip, deflate, br" if brotli is not None else "gzip, deflate",
+    "DNT": "1",
+    "Connection": "keep-alive",
+    "Upgrade-Insecure-Requests": "1",
+    "Sec-Fetch-Dest": "document",
+    "Sec-Fetch-Mode": "navigate",
+    "Sec-Fetch-Site": "none",
+    "Sec-Fetch-User": "?1",
+    "Cache-Control": "max-age=0",
+    "sec-ch-ua": '"Not A(Brand";v="99", "Google Chrome";v="121", "Chromium";v="121"',
+    "sec-ch-ua-mobile": "?0",
+    "sec-ch-ua-platform": '"Windows"'
+}
+
+# App-wide HTTP session, created in post_init and closed in post_shutdown
+SHARED_SESSION: Optional[aiohttp.ClientSession] = None
+
 # =============================================================================
 # DATA CLASSES
 # =============================================================================
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class VisaSlot:
     """Represents a visa slot entry"""
     location: str
@@ -97,7 +202,7 @@ class VisaSlot:
         }
 
 
-@dataclass
+@dataclass(slots=True)
 class UserPreferences:
     """User preferences for slot monitoring"""
     visa_type: Optional[str] = None
@@ -106,7 +211,7 @@ class UserPreferences:
     interval: Optional[int] = None
     year_filter: Optional[List[str]] = None
     no_slot_alert_sent: bool = False
-    last_notified_slots: List[str] = field(default_factory=list)
+    last_notified_slots: OrderedDict[int, None] = field(default_factory=OrderedDict)
 
     def is_complete(self) -> bool:
         """Check if all required preferences are set"""
@@ -141,7 +246,7 @@ class UserPreferences:
             "interval": self.interval,
             "year_filter": self.year_filter,
             "no_slot_alert_sent": self.no_slot_alert_sent,
-            "last_notified_slots": self.last_notified_slots
+            "last_notified_slots": list(self.last_notified_slots)
         }
 
     @classmethod
@@ -154,7 +259,10 @@ class UserPreferences:
             interval=data.get("interval"),
             year_filter=data.get("year_filter"),
             no_slot_alert_sent=data.get("no_slot_alert_sent", False),
-            last_notified_slots=data.get("last_notified_slots", [])
+            last_notified_slots=OrderedDict.fromkeys(
+                # Older files stored "location_date" strings, start those afresh
+                key for key in data.get("last_notified_slots", []) if isinstance(key, int)
+            )
         )
 
 
@@ -171,13 +279,24 @@ class UserDataPersistence:
 
     def save_user_data(self, user_data: Dict[int, UserPreferences]):
         """Save user data to file"""
+        self.write_snapshot(self.snapshot(user_data))
+
+    @staticmethod
+    def snapshot(user_data: Dict[int, UserPreferences]) -> Dict[str, dict]:
+        """Copy user data into plain dicts that can be written from another thread"""
+        return {
+            str(chat_id): prefs.to_dict()
+            for chat_id, prefs in user_data.items()
+        }
+
+    def write_snapshot(self, data: Dict[str, dict]):
+        """Write a snapshot taken with snapshot() to file"""
         try:
-            data = {
-                str(chat_id): prefs.to_dict()
-                for chat_id, prefs in user_data.items()
-            }
-            with open(self.data_file, 'w') as f:
-                json.dump(data, f, indent=2)
+            # Write a sibling file and swap it in, so a crash mid-save
+            # never leaves a truncated user_data.json behind
+            tmp_file = self.data_file.with_suffix(".tmp")
+            tmp_file.write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+            tmp_file.replace(self.data_file)
             logger.info(f"Saved data for {len(data)} users")
         except Exception as e:
             logger.error(f"Error saving user data: {e}")
@@ -188,8 +307,7 @@ class UserDataPersistence:
             if not self.data_file.exists():
                 return {}
             
-            with open(self.data_file, 'r') as f:
-                data = json.load(f)
+            data = orjson.loads(self.data_file.read_bytes())
             
             user_data = {
                 int(chat_id): UserPreferences.from_dict(prefs)
@@ -207,46 +325,140 @@ class UserDataPersistence:
 # =============================================================================
 
 class UserDataManager:
-    """Thread-safe user data manager with persistence"""
+    """User data manager with persistence, owned by the single event loop"""
     
     def __init__(self):
         self.persistence = UserDataPersistence()
         self._user_data: Dict[int, UserPreferences] = self.persistence.load_user_data()
-        self._alert_tasks: Dict[int, asyncio.Task] = {}
-        self._lock = asyncio.Lock()
-
-    async def get_preferences(self, chat_id: int) -> UserPreferences:
+        # chat_id -> interval for users with running alerts
+        self._subscribers: Dict[int, int] = {}
+        # Min-heap of (due time, chat_id), entries not matching _next_due are stale
+        self._schedule: List[Tuple[float, int]] = []
+        self._next_due: Dict[int, float] = {}
+        self.schedule_changed = asyncio.Event()
+        self._poll_task: Optional[asyncio.Task] = None
+        self._dirty = asyncio.Event()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._write_task: Optional[asyncio.Task] = None
+
+    def get_preferences(self, chat_id: int) -> UserPreferences:
         """Get or create user preferences"""
-        async with self._lock:
-            if chat_id not in self._user_data:
-                self._user_data[chat_id] = UserPreferences()
-                self._save_data()
-            return self._user_data[chat_id]
+        preferences = self._user_data.get(chat_id)
+        if preferences is None:
+            preferences = self._user_data[chat_id] = UserPreferences()
+            self.mark_dirty()
+        return preferences
+
+    def mark_dirty(self):
+        """Schedule a save, coalesced with any other changes made meanwhile"""
+        self._dirty.set()
+
+    def start_flushing(self):
+        """Start the background task that writes pending changes to disk"""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        """Write pending changes at most once every SAVE_DEBOUNCE seconds"""
+        while True:
+            await self._dirty.wait()
+            await asyncio.sleep(SAVE_DEBOUNCE)
+            self._dirty.clear()
+            # Snapshot on the loop so handlers can't change it mid-write,
+            # then serialize and write in a thread
+            data = self.persistence.snapshot(self._user_data)
+            self._write_task = asyncio.create_task(
+                asyncio.to_thread(self.persistence.write_snapshot, data)
+            )
+            # Shielded so shutdown waits for the write instead of abandoning it
+            await asyncio.shield(self._write_task)
+
+    async def close(self):
+        """Stop background flushing and write any pending changes"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+        if self._write_task:
+            await self._write_task
+        if self._dirty.is_set():
+            self._save_data()
 
     def _save_data(self):
         """Save data to disk"""
         self.persistence.save_user_data(self._user_data)
+        self._dirty.clear()
 
-    async def set_alert_task(self, chat_id: int, task: asyncio.Task):
-        """Set alert task for user"""
-        async with self._lock:
-            self._alert_tasks[chat_id] = task
-
-    async def get_alert_task(self, chat_id: int) -> Optional[asyncio.Task]:
-        """Get alert task for user"""
-        async with self._lock:
-            return self._alert_tasks.get(chat_id)
-
-    async def remove_alert_task(self, chat_id: int):
-        """Remove alert task for user"""
-        async with self._lock:
-            if chat_id in self._alert_tasks:
-                del self._alert_tasks[chat_id]
+    def subscribe(
+        self,
+        chat_id: int,
+        interval: int,
+        start_poller: Callable[[], asyncio.Task]
+    ) -> bool:
+        """Run user's alerts at interval, returns True if already running"""
+        old_interval = self._subscribers.get(chat_id)
+        self._subscribers[chat_id] = interval
+        if old_interval is None:
+            # New subscribers are checked right away by the caller
+            self._schedule_check(chat_id, time.monotonic() + interval)
+        else:
+            # Keep the last check time, only the interval changes
+            self._schedule_check(chat_id, self._next_due[chat_id] - old_interval + interval)
+        if self._poll_task is None or self._poll_task.done():
+            self._poll_task = start_poller()
+        return old_interval is not None
+
+    def unsubscribe(self, chat_id: int) -> bool:
+        """Stop user's alerts, returns True if alerts were running"""
+        if self._subscribers.pop(chat_id, None) is None:
+            return False
+        self._next_due.pop(chat_id, None)
+        if not self._subscribers and self._poll_task:
+            self._poll_task.cancel()
+            self._poll_task = None
+        return True
 
-    async def is_running(self, chat_id: int) -> bool:
+    def _schedule_check(self, chat_id: int, due: float):
+        """Schedule user's next check, superseding any earlier entry"""
+        if self._next_due.get(chat_id) == due:
+            return  # An identical entry would be popped twice
+        self._next_due[chat_id] = due
+        heapq.heappush(self._schedule, (due, chat_id))
+        self.schedule_changed.set()
+
+    def next_due(self) -> Optional[float]:
+        """Get when the soonest user is due, dropping stale entries"""
+        while self._schedule:
+            due, chat_id = self._schedule[0]
+            if self._next_due.get(chat_id) == due:
+                return due
+            heapq.heappop(self._schedule)
+        return None
+
+    def pop_due(self, now: float) -> List[int]:
+        """Get users due by now and schedule their next check"""
+        # Half a tick of slack so nearby users share this check
+        horizon = now + POLL_TICK / 2
+        due_ids = []
+        while (due := self.next_due()) is not None and due <= horizon:
+            chat_id = heapq.heappop(self._schedule)[1]
+            # Leftover entries with the same due time are now stale
+            del self._next_due[chat_id]
+            due_ids.append(chat_id)
+        for chat_id in due_ids:
+            self._schedule_check(chat_id, now + self._subscribers[chat_id])
+        return due_ids
+
+    def remove_poll_task(self, task: asyncio.Task):
+        """Forget a finished poller unless it has been replaced"""
+        if self._poll_task is task:
+            self._poll_task = None
+
+    def is_running(self, chat_id: int) -> bool:
         """Check if alerts are running for user"""
-        task = await self.get_alert_task(chat_id)
-        return task is not None and not task.done()
+        return chat_id in self._subscribers
 
 
 user_manager = UserDataManager()
@@ -256,12 +468,10 @@ user_manager = UserDataManager()
 # UTILITIES
 # =============================================================================
 
-def visa_matches_site(user_pref: str, site_visa: str) -> bool:
-    """Check if user's visa preference matches site visa type"""
-    user_pref = user_pref.upper().strip()
-    site_visa = site_visa.upper().strip()
-    
-    visa_mappings = {
+# User visa preference -> site visa labels that satisfy it
+_VISA_MAPPINGS: Dict[str, frozenset] = {
+    visa.upper(): frozenset(labels)
+    for visa, labels in {
         "B1": ["B1", "B1/B2"],
         "B2": ["B2", "B1/B2"],
         "B1/B2": ["B1/B2"],
@@ -270,19 +480,41 @@ def visa_matches_site(user_pref: str, site_visa: str) -> bool:
         "J-1": ["J1", "J-1"],
         "L-1": ["L1", "L-1"],
         "O-1": ["O1", "O-1"]
-    }
+    }.items()
+}
+
+
+@lru_cache(maxsize=256)
+def visa_matches_site(user_pref: str, site_visa: str) -> bool:
+    """Check if user's visa preference matches site visa type"""
+    user_pref = user_pref.upper().strip()
+    site_visa = site_visa.upper().strip()
     
-    if user_pref in visa_mappings:
-        return site_visa in visa_mappings[user_pref]
+    labels = _VISA_MAPPINGS.get(user_pref)
+    if labels is not None:
+        return site_visa in labels
     
     return user_pref == site_visa
 
 
+@lru_cache(maxsize=64)
+def year_pattern(years: Tuple[str, ...]) -> Optional[re.Pattern]:
+    """Compile a year filter into one alternation, once per distinct filter"""
+    return re.compile("|".join(map(re.escape, years))) if years else None
+
+
 def year_matches(date_str: str, year_filter: Optional[List[str]]) -> bool:
     """Check if date matches year filter"""
     if not year_filter or date_str in ["N/A", "", None]:
         return True
-    return any(year in date_str for year in year_filter)
+    return year_pattern(tuple(year_filter)).search(date_str) is not None
+
+
+@lru_cache(maxsize=1024)
+def slot_fingerprint(slot: VisaSlot) -> int:
+    """64-bit fingerprint of a slot's location and date, stable across restarts"""
+    key = f"{slot.location}|{slot.earliest_date}".encode()
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "big")
 
 
 def validate_environment() -> bool:
@@ -290,6 +522,10 @@ def validate_environment() -> bool:
     if not BOT_TOKEN:
         logger.error("BOT_TOKEN not found in environment variables!")
         return False
+    if MAX_CONCURRENT_CHECKS < 1:
+        # A zero semaphore would block every check forever without an error
+        logger.error(f"MAX_CONCURRENT_CHECKS must be at least 1, got {MAX_CONCURRENT_CHECKS}")
+        return False
     return True
 
 
@@ -297,187 +533,382 @@ def validate_environment() -> bool:
 # ENHANCED WEB SCRAPING WITH ANTI-DETECTION
 # =============================================================================
 
+# The parsers do their work in C, so a small thread pool is enough
+PARSE_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="html-parse")
+# Block and error pages have no table, a C scan spots them without a DOM
+TABLE_TAG_RE = re.compile(rb"<table", re.IGNORECASE)
+
+
+def build_http_session() -> aiohttp.ClientSession:
+    """Create the HTTP session shared by all users and alert loops"""
+    connector = aiohttp.TCPConnector(
+        limit=50,
+        limit_per_host=10,  # Bound bursts against visaslots.info
+        ttl_dns_cache=300,  # Cache DNS lookups for 5 minutes
+        keepalive_timeout=60,  # Reuse connections between polls
+        ssl=False  # Disable SSL verification if needed
+    )
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+        headers=BROWSER_HEADERS
+    )
+
+
+def _extract_rows_lexbor(body: bytes) -> Tuple[int, List[Tuple[str, ...]]]:
+    """Extract the first five cell texts of each data row with lexbor"""
+    tree = LexborHTMLParser(body)
+    tables = tree.css("table")
+    rows = []
+    for table in tables:
+        for row in table.css("tr")[1:]:  # Skip header
+            cells = row.css("td")
+            if len(cells) >= 5:
+                rows.append(tuple(cell.text().strip() for cell in cells[:5]))
+    return len(tables), rows
+
+
+def _extract_rows_lxml(body: bytes) -> Tuple[int, List[Tuple[str, ...]]]:
+    """Extract the first five cell texts of each data row with lxml"""
+    root = lxml.html.fromstring(body, parser=lxml.html.HTMLParser(encoding="utf-8"))
+    tables = root.xpath("//table")
+    # First five cells of every row with at least five cells, skipping
+    # each table's first row (counted across thead/tbody, like lexbor),
+    # as one flat list in document order
+    cells = root.xpath("//table/descendant::tr[position()>1][td[5]]/td[position()<=5]")
+    texts = (cell.text_content().strip() for cell in cells)
+    return len(tables), list(zip(*[texts] * 5))
+
+
+def parse_slots_html(body: bytes, encoding: str = "utf-8") -> List[VisaSlot]:
+    """Parse the raw page body and extract visa slots
+    
+    A plain module function, so it can run in any executor.
+    """
+    try:
+        # Both engines decode UTF-8 bytes themselves, so the usual page
+        # goes in without an intermediate str. Other charsets are rare.
+        try:
+            codec_name = codecs.lookup(encoding).name
+        except LookupError:
+            # Bogus header charset (e.g. utf8mb4), treat the page as UTF-8
+            logger.debug(f"Unknown charset {encoding!r}, decoding as UTF-8")
+            codec_name = "utf-8"
+        if codec_name != "utf-8":
+            body = body.decode(encoding, errors="replace").encode("utf-8")
+
+        if TABLE_TAG_RE.search(body) is None:
+            table_count, rows = 0, []
+        elif LexborHTMLParser is not None:
+            table_count, rows = _extract_rows_lexbor(body)
+        else:
+            table_count, rows = _extract_rows_lxml(body)
+
+        if not table_count:
+            logger.warning("⚠️ No tables found in HTML")
+            # Log a sample of the HTML for debugging
+            logger.debug(f"HTML preview: {body[:500].decode('utf-8', errors='replace')}")
+            return []
+
+        all_slots = []
+
+        intern = sys.intern
+        for location, visa_type, last_updated, earliest_date, slots_available in rows:
+            # Intern the low-cardinality fields so every poll's slots
+            # share one copy of each city, visa type, date and count
+            all_slots.append(VisaSlot(
+                location=intern(location),
+                visa_type=intern(visa_type),
+                last_updated=last_updated,
+                earliest_date=intern(earliest_date),
+                slots_available=intern(slots_available)
+            ))
+
+        logger.info(f"📊 Parsed {len(all_slots)} slots from {table_count} tables")
+        return all_slots
+
+    except Exception as e:
+        logger.error(f"❌ Error parsing HTML: {e}", exc_info=True)
+        return []
+
+
 class VisaSlotsScraper:
     """Enhanced web scraper with anti-detection measures"""
     
-    def __init__(self, url: str = VISA_SLOTS_URL):
+    def __init__(self, url: str = VISA_SLOTS_URL, session: Optional[aiohttp.ClientSession] = None):
         self.url = url
-        self.session: Optional[aiohttp.ClientSession] = None
-
-    async def __aenter__(self):
-        """Async context manager entry with rotating user agents"""
-        # Rotate between different realistic user agents
-        user_agents = [
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36",
-            "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36",
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:122.0) Gecko/20100101 Firefox/122.0",
-            "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.2.1 Safari/605.1.15",
-            "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36"
-        ]
-        
-        import random
-        selected_ua = random.choice(user_agents)
+        self.session = session
+        # Validators and slots from the last successful fetch
+        self._etag: Optional[str] = None
+        self._last_modified: Optional[str] = None
+        self._body_digest: Optional[bytes] = None
+        self._cached_slots: List[VisaSlot] = []
+        self.last_success = 0.0  # time.monotonic() of the last good fetch
+
+    def _request_headers(self) -> Dict[str, str]:
+        """Build per-request headers: a rotated user agent plus conditional GET validators"""
+        headers = {"User-Agent": random.choice(USER_AGENTS)}
+        if not self._cached_slots:
+            return headers
+        if self._etag:
+            headers["If-None-Match"] = self._etag
+        if self._last_modified:
+            headers["If-Modified-Since"] = self._last_modified
+        return headers
+
+    def _retry_delay(self, attempt: int) -> float:
+        """Exponential backoff with jitter, capped at MAX_RETRY_BACKOFF"""
+        return min(MAX_RETRY_BACKOFF, 2 ** attempt) + random.uniform(0, 1)
+
+    async def _read_body(self, response: aiohttp.ClientResponse) -> Optional[Tuple[bytes, bytes]]:
+        """Stream the body, returning it with its digest, or None if over MAX_PAGE_BYTES"""
+        if (response.content_length or 0) > MAX_PAGE_BYTES:
+            return None
+        # Hash while chunks arrive instead of in a second pass over the body
+        hasher = hashlib.blake2b(digest_size=16)
+        chunks = []
+        size = 0
+        async for chunk in response.content.iter_chunked(64 * 1024):
+            size += len(chunk)
+            if size > MAX_PAGE_BYTES:
+                return None
+            hasher.update(chunk)
+            chunks.append(chunk)
+        return b"".join(chunks), hasher.digest()
+
+    async def fetch_slots(self, stale_ok: float = 0) -> List[VisaSlot]:
+        """Fetch visa slots with enhanced anti-detection
         
-        connector = aiohttp.TCPConnector(
-            limit=10,
-            ssl=False,  # Disable SSL verification if needed
-            force_close=True  # Close connections after each request
-        )
+        If a retry is needed and the last good slots are younger than
+        stale_ok seconds, they are returned instead of waiting to retry.
+        """
+        retry_after: Optional[float] = None
         
-        self.session = aiohttp.ClientSession(
-            connector=connector,
-            timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
-            headers={
-                "User-Agent": selected_ua,
-                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8",
-                "Accept-Language": "en-US,en;q=0.9",
-                "Accept-Encoding": "gzip, deflate, br",
-                "DNT": "1",
-                "Connection": "keep-alive",
-                "Upgrade-Insecure-Requests": "1",
-                "Sec-Fetch-Dest": "document",
-                "Sec-Fetch-Mode": "navigate",
-                "Sec-Fetch-Site": "none",
-                "Sec-Fetch-User": "?1",
-                "Cache-Control": "max-age=0",
-                "sec-ch-ua": '"Not A(Brand";v="99", "Google Chrome";v="121", "Chromium";v="121"',
-                "sec-ch-ua-mobile": "?0",
-                "sec-ch-ua-platform": '"Windows"'
-            }
-        )
-        return self
-
-    async def __aexit__(self, exc_type, exc_val, exc_tb):
-        """Async context manager exit"""
-        if self.session:
-            await self.session.close()
-            # Give time for connections to close
-            await asyncio.sleep(0.5)
-
-    async def fetch_slots(self) -> List[VisaSlot]:
-        """Fetch visa slots with enhanced anti-detection"""
         for attempt in range(MAX_RETRIES):
+            if attempt > 0:
+                if self._cached_slots and time.monotonic() - self.last_success < stale_ok:
+                    logger.info(f"♻️ Reusing {len(self._cached_slots)} recent slots instead of retrying")
+                    return self._cached_slots
+                
+                delay = retry_after if retry_after is not None else self._retry_delay(attempt)
+                retry_after = None
+                logger.info(f"⏳ Waiting {delay:.1f}s before retry...")
+                await asyncio.sleep(delay)
+            
             try:
                 if not self.session:
                     raise RuntimeError("Session not initialized")
                 
                 logger.info(f"🌐 Fetching visa slots (attempt {attempt + 1}/{MAX_RETRIES})")
                 
-                # Add random delay between retries to appear more human-like
-                if attempt > 0:
-                    delay = RETRY_DELAY * (attempt + 1) + random.uniform(1, 3)
-                    logger.info(f"⏳ Waiting {delay:.1f}s before retry...")
-                    await asyncio.sleep(delay)
-                
                 async with self.session.get(
                     self.url,
+                    headers=self._request_headers(),
                     allow_redirects=True,
                     ssl=False  # Disable SSL verification
                 ) as response:
                     
+                    if response.status == 304 and self._cached_slots:
+                        logger.info(f"♻️ Page unchanged, reusing {len(self._cached_slots)} slots")
+                        self.last_success = time.monotonic()
+                        return self._cached_slots
+                    
                     if response.status == 403:
                         logger.warning(f"⚠️ Access forbidden (403) - Attempt {attempt + 1}/{MAX_RETRIES}")
                         if attempt < MAX_RETRIES - 1:
-                            # Wait longer on 403
-                            await asyncio.sleep(RETRY_DELAY * (attempt + 2) * 3)
+                            # Back off well past the normal retry delay while blocked
+                            retry_after = RETRY_DELAY * (attempt + 2) * 3
                             continue
                         logger.error("❌ Website is blocking requests after all retries")
                         return []
                     
                     if response.status == 429:
                         logger.warning("⚠️ Rate limited (429)")
-                        retry_after = int(response.headers.get('Retry-After', 60))
-                        logger.info(f"⏳ Waiting {retry_after}s as requested...")
-                        await asyncio.sleep(retry_after)
+                        retry_after = float(response.headers.get('Retry-After', 60))
                         continue
                     
                     if response.status != 200:
                         logger.warning(f"⚠️ HTTP {response.status} received")
-                        if attempt < MAX_RETRIES - 1:
-                            await asyncio.sleep(RETRY_DELAY * (attempt + 1))
-                            continue
-                        return []
+                        continue
                     
-                    html = await response.text()
+                    read = await self._read_body(response)
+                    if read is None:
+                        logger.warning(f"⚠️ Response larger than {MAX_PAGE_BYTES} bytes, discarded")
+                        continue
+                    body, digest = read
                     
-                    if len(html) < 100:
+                    if len(body) < 100:
                         logger.warning("⚠️ Received suspiciously short response")
                         if attempt < MAX_RETRIES - 1:
-                            await asyncio.sleep(RETRY_DELAY * (attempt + 1))
                             continue
                     
-                    slots = self._parse_html(html)
+                    if digest == self._body_digest and self._cached_slots:
+                        logger.info(f"♻️ Page content unchanged, reusing {len(self._cached_slots)} slots")
+                        # Keep the validators current, or a regenerated page's new
+                        # ETag never gets sent and the 304 path stops firing
+                        self._etag = response.headers.get("ETag")
+                        self._last_modified = response.headers.get("Last-Modified")
+                        self.last_success = time.monotonic()
+                        return self._cached_slots
+                    
+                    # Parse off the event loop so sends and handlers stay responsive.
+                    # Charset comes from the headers only: get_encoding() needs
+                    # response.read() to have run and raises after a streamed read.
+                    slots = await asyncio.get_running_loop().run_in_executor(
+                        PARSE_EXECUTOR, parse_slots_html, body, response.charset or "utf-8"
+                    )
                     
                     if not slots:
                         logger.warning("⚠️ No slots parsed from HTML")
                         if attempt < MAX_RETRIES - 1:
                             continue
                     
+                    if slots:
+                        self._etag = response.headers.get("ETag")
+                        self._last_modified = response.headers.get("Last-Modified")
+                        self._body_digest = digest
+                        self._cached_slots = slots
+                        self.last_success = time.monotonic()
+                    
                     logger.info(f"✅ Successfully fetched {len(slots)} slots")
                     return slots
                     
             except asyncio.TimeoutError:
                 logger.error(f"⏱️ Timeout on attempt {attempt + 1}")
-                if attempt < MAX_RETRIES - 1:
-                    await asyncio.sleep(RETRY_DELAY * (attempt + 1))
                     
             except aiohttp.ClientError as e:
                 logger.error(f"🔌 Network error on attempt {attempt + 1}: {e}")
-                if attempt < MAX_RETRIES - 1:
-                    await asyncio.sleep(RETRY_DELAY * (attempt + 1))
                     
             except Exception as e:
                 logger.error(f"❌ Unexpected error: {e}", exc_info=True)
-                if attempt < MAX_RETRIES - 1:
-                    await asyncio.sleep(RETRY_DELAY * (attempt + 1))
         
         logger.error("❌ All fetch attempts failed")
         return []
 
-    def _parse_html(self, html: str) -> List[VisaSlot]:
-        """Parse HTML and extract visa slots"""
-        try:
-            soup = BeautifulSoup(html, "html.parser")
-            tables = soup.find_all("table")
-            
-            if not tables:
-                logger.warning("⚠️ No tables found in HTML")
-                # Log a sample of the HTML for debugging
-                logger.debug(f"HTML preview: {html[:500]}")
-                return []
-            
-            all_slots = []
-            
-            for table in tables:
-                rows = table.find_all("tr")[1:]  # Skip header
-                for row in rows:
-                    cols = row.find_all("td")
-                    if len(cols) >= 5:
-                        slot = VisaSlot(
-                            location=cols[0].text.strip(),
-                            visa_type=cols[1].text.strip(),
-                            last_updated=cols[2].text.strip(),
-                            earliest_date=cols[3].text.strip(),
-                            slots_available=cols[4].text.strip()
-                        )
-                        all_slots.append(slot)
-            
-            logger.info(f"📊 Parsed {len(all_slots)} slots from {len(tables)} tables")
-            return all_slots
-            
-        except Exception as e:
-            logger.error(f"❌ Error parsing HTML: {e}", exc_info=True)
-            return []
+
+class SlotCache:
+    """Shared slot data so concurrent users trigger a single fetch"""
+
+    def __init__(self):
+        self.scraper: Optional[VisaSlotsScraper] = None
+        self._slots: List[VisaSlot] = []
+        self._timestamp = 0.0
+        self._inflight: Optional[asyncio.Task] = None
+
+    def _is_fresh(self, max_age: float) -> bool:
+        """Check if cached slots are younger than max_age seconds"""
+        return bool(self._slots) and time.monotonic() - self._timestamp < max_age
+
+    async def get(self, max_age: float) -> List[VisaSlot]:
+        """Get slots, fetching only if the cached data is older than max_age"""
+        if self._is_fresh(max_age):
+            return self._slots
+
+        if self._inflight is None:
+            self._inflight = asyncio.create_task(self._refresh(max_age))
+            self._inflight.add_done_callback(self._clear_inflight)
+        # Every caller awaits the same fetch, shielded so one caller being
+        # cancelled doesn't abort it for the rest
+        return await asyncio.shield(self._inflight)
+
+    def _clear_inflight(self, task: asyncio.Task):
+        """Let the next stale read start a new fetch"""
+        if self._inflight is task:
+            self._inflight = None
+
+    async def _refresh(self, max_age: float) -> List[VisaSlot]:
+        """Fetch and store fresh slots"""
+        if not self.scraper:
+            raise RuntimeError("Scraper not initialized")
+        # Recent data beats retrying against a struggling upstream
+        self._slots = await self.scraper.fetch_slots(stale_ok=max_age * 2)
+        if self._slots:
+            self._timestamp = self.scraper.last_success
+        return self._slots
+
+
+slot_cache = SlotCache()
 
 # =============================================================================
 # TELEGRAM MESSAGING
 # =============================================================================
 
+# Characters MarkdownV2 treats as markup anywhere outside an entity
+_MARKDOWN_V2_ESCAPES = str.maketrans({c: "\\" + c for c in "\\_*[]()~`>#+-=|{}.!"})
+
+
+def escape_markdown_v2(text: str) -> str:
+    """Escape text so Telegram shows it literally in a MarkdownV2 message"""
+    return text.translate(_MARKDOWN_V2_ESCAPES)
+
+
+# Inside a link target only ")" and "\" need escaping
+_ALERT_LINK = VISA_SLOTS_URL.replace("\\", "\\\\").replace(")", "\\)")
+
+# Built once at import, alerts only fill in fields escaped for MarkdownV2,
+# so a "_" or "*" in site data shows literally instead of failing the send
+SLOT_ALERT_TEMPLATE = partial((
+    "{emoji} *Visa Slot Alert\\!* 🚨\n\n"
+    "{entries}\n\n"
+    "🔗 [Check Website]({url})\n\n"
+    "_No login required\\!_"
+).format, url=_ALERT_LINK)
+SLOT_ENTRY_TEMPLATE = (
+    "{emoji} *Location:* {location}\n"
+    "📌 *Visa Type:* {visa_type}\n"
+    "📅 *Earliest Date:* {earliest_date}\n"
+    "🟢 *Slots:* {slots_available}\n"
+    "🕐 *Updated:* {last_updated}"
+).format
+
+
+@lru_cache(maxsize=512)
+def render_slot_entry(slot: VisaSlot, is_new: bool) -> str:
+    """Render one alert entry, shared by every user alerted about the slot"""
+    return SLOT_ENTRY_TEMPLATE(
+        emoji="🆕" if is_new else "🔄",
+        location=escape_markdown_v2(slot.location),
+        visa_type=escape_markdown_v2(slot.visa_type),
+        earliest_date=escape_markdown_v2(slot.earliest_date),
+        slots_available=escape_markdown_v2(slot.slots_available),
+        last_updated=escape_markdown_v2(slot.last_updated)
+    )
+
+
+def chunk_entries(entries: List[str], limit: int, separator: str = "\n\n") -> List[List[str]]:
+    """Group entries in order so each group joined by separator fits in limit"""
+    chunks: List[List[str]] = []
+    size = limit  # Full, so the first entry starts a chunk
+    for entry in entries:
+        if size + len(separator) + len(entry) > limit:
+            chunks.append([entry])
+            size = len(entry)
+        else:
+            chunks[-1].append(entry)
+            size += len(separator) + len(entry)
+    return chunks
+
+
 class TelegramMessenger:
     """Handle Telegram message sending"""
     
-    def __init__(self, bot_token: str):
-        self.bot = Bot(token=bot_token)
+    def __init__(self, bot: Bot):
+        # The application's bot, so alerts share its tuned connection pool
+        self.bot = bot
+        # Serialize sends per chat so messages keep their order
+        self._chat_locks: Dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self._chat_next_send: Dict[int, float] = {}
+        self._global_next_send = 0.0
+        self._send_semaphore = asyncio.Semaphore(MAX_CONCURRENT_SENDS)
+
+    async def _wait_for_send_slot(self, chat_id: int):
+        """Reserve the next send time allowed by the per-chat and global rates"""
+        now = asyncio.get_running_loop().time()
+        start = max(now, self._global_next_send, self._chat_next_send.get(chat_id, 0.0))
+        self._global_next_send = start + GLOBAL_SEND_INTERVAL
+        self._chat_next_send[chat_id] = start + PER_CHAT_SEND_INTERVAL
+        if start > now:
+            await asyncio.sleep(start - now)
 
     async def send_message(
         self,
@@ -486,21 +917,36 @@ class TelegramMessenger:
         parse_mode: str = "Markdown",
         reply_markup=None
     ) -> bool:
-        """Send message with retry logic"""
+        """Send message with rate limiting and retry logic"""
+        async with self._chat_locks[chat_id]:
+            return await self._send_with_retries(chat_id, text, parse_mode, reply_markup)
+
+    async def _send_with_retries(
+        self,
+        chat_id: int,
+        text: str,
+        parse_mode: str,
+        reply_markup
+    ) -> bool:
+        """Send message, retrying on timeouts and Telegram errors"""
         for attempt in range(MAX_RETRIES):
+            await self._wait_for_send_slot(chat_id)
             try:
-                await self.bot.send_message(
-                    chat_id=chat_id,
-                    text=text,
-                    parse_mode=parse_mode,
-                    reply_markup=reply_markup,
-                    disable_web_page_preview=True
-                )
+                async with self._send_semaphore:
+                    await self.bot.send_message(
+                        chat_id=chat_id,
+                        text=text,
+                        parse_mode=parse_mode,
+                        reply_markup=reply_markup,
+                        disable_web_page_preview=True
+                    )
                 return True
                 
             except RetryAfter as e:
+                # Flood control applies to the whole bot, hold back every chat
                 logger.warning(f"⏳ Rate limited. Waiting {e.retry_after}s")
-                await asyncio.sleep(e.retry_after)
+                resume_at = asyncio.get_running_loop().time() + e.retry_after
+                self._global_next_send = max(self._global_next_send, resume_at)
                 
             except TimedOut:
                 logger.warning(f"⏱️ Timeout on attempt {attempt + 1}")
@@ -520,20 +966,19 @@ class TelegramMessenger:
         
         return False
 
-    async def send_slot_alert(self, chat_id: int, slot: VisaSlot, is_new: bool = True) -> bool:
-        """Send visa slot alert"""
-        emoji = "🆕" if is_new else "🔄"
-        message = (
-            f"{emoji} *Visa Slot Alert!* 🚨\n\n"
-            f"📍 *Location:* {slot.location}\n"
-            f"📌 *Visa Type:* {slot.visa_type}\n"
-            f"📅 *Earliest Date:* {slot.earliest_date}\n"
-            f"🟢 *Slots:* {slot.slots_available}\n"
-            f"🕐 *Updated:* {slot.last_updated}\n\n"
-            f"🔗 [Check Website]({VISA_SLOTS_URL})\n\n"
-            f"_No login required!_"
-        )
-        return await self.send_message(chat_id, message)
+    async def send_slot_alert(self, chat_id: int, slots: List[Tuple[VisaSlot, bool]]) -> bool:
+        """Send every (slot, is_new) pair in as few alerts as fit Telegram's limit"""
+        entries = [render_slot_entry(slot, is_new) for slot, is_new in slots]
+        emoji = "🆕" if any(is_new for _, is_new in slots) else "🔄"
+        # Whatever the header and footer leave of the message limit
+        budget = MAX_MESSAGE_LENGTH - len(SLOT_ALERT_TEMPLATE(emoji=emoji, entries=""))
+        
+        all_sent = True
+        # Sequential, the per-chat rate limit would serialize them anyway
+        for chunk in chunk_entries(entries, budget):
+            message = SLOT_ALERT_TEMPLATE(emoji=emoji, entries="\n\n".join(chunk))
+            all_sent = await self.send_message(chat_id, message, parse_mode="MarkdownV2") and all_sent
+        return all_sent
 
 
 # =============================================================================
@@ -542,43 +987,74 @@ class TelegramMessenger:
 
 class SlotFilter:
     """Filter visa slots based on user preferences"""
-    
-    @staticmethod
+
+    # Work shared between users for the latest snapshot: open slots per
+    # visa type, and whole results per distinct set of filter preferences
+    _snapshot: Optional[List[VisaSlot]] = None
+    _open_by_visa: Dict[str, List[VisaSlot]] = {}
+    _results: Dict[tuple, Tuple[List[VisaSlot], List[VisaSlot]]] = {}
+
+    @classmethod
+    def _use_snapshot(cls, all_slots: List[VisaSlot]):
+        """Drop memoized work when a different snapshot comes in"""
+        if all_slots is not cls._snapshot:
+            # The cache hands out a new list only when the page changed
+            cls._snapshot = all_slots
+            cls._open_by_visa = {}
+            cls._results = {}
+
+    @classmethod
+    def _open_slots_for_visa(cls, all_slots: List[VisaSlot], visa_type: str) -> List[VisaSlot]:
+        """Get the available slots matching visa_type, computed once per snapshot"""
+        open_slots = cls._open_by_visa.get(visa_type)
+        if open_slots is None:
+            open_slots = cls._open_by_visa[visa_type] = [
+                slot for slot in all_slots
+                if slot.is_available() and visa_matches_site(visa_type, slot.visa_type)
+            ]
+        return open_slots
+
+    @classmethod
     def filter_slots(
+        cls,
         all_slots: List[VisaSlot],
         preferences: UserPreferences
     ) -> tuple[List[VisaSlot], List[VisaSlot]]:
-        """Filter slots into matching and other locations"""
-        matching_preference = []
-        other_locations = []
+        """Filter slots into matching and other locations
+        
+        Users with identical filters get the same, shared, lists back.
+        """
+        cls._use_snapshot(all_slots)
+        years = tuple(preferences.year_filter or ())
+        key = (preferences.visa_type, preferences.consulate_city, preferences.consulate_type, years)
+        result = cls._results.get(key)
+        if result is not None:
+            return result
+
+        matching_open = []
+        other_open = []
+
+        # One compiled scan per date instead of a substring test per year
+        year_re = year_pattern(years)
+        # Pick the location test once, as a C-level callable, rather than
+        # branching per slot. Locations are stripped when parsed.
+        if preferences.consulate_city == "ALL":
+            is_preferred = operator.methodcaller("endswith", preferences.consulate_type)
+        else:
+            is_preferred = partial(operator.eq, preferences.get_full_consulate())
 
-        for slot in all_slots:
-            if not visa_matches_site(preferences.visa_type, slot.visa_type):
+        # is_available() already ruled out empty and N/A dates
+        for slot in cls._open_slots_for_visa(all_slots, preferences.visa_type):
+            if year_re is not None and year_re.search(slot.earliest_date) is None:
                 continue
 
-            if preferences.consulate_city == "ALL":
-                if slot.location.strip().endswith(preferences.consulate_type):
-                    matching_preference.append(slot)
-                else:
-                    other_locations.append(slot)
+            if is_preferred(slot.location):
+                matching_open.append(slot)
             else:
-                preferred_location = preferences.get_full_consulate()
-                if slot.location == preferred_location:
-                    matching_preference.append(slot)
-                else:
-                    other_locations.append(slot)
+                other_open.append(slot)
 
-        matching_open = [
-            s for s in matching_preference
-            if s.is_available() and year_matches(s.earliest_date, preferences.year_filter)
-        ]
-
-        other_open = [
-            s for s in other_locations
-            if s.is_available() and year_matches(s.earliest_date, preferences.year_filter)
-        ]
-
-        return matching_open, other_open
+        result = cls._results[key] = (matching_open, other_open)
+        return result
 
 
 # =============================================================================
@@ -590,56 +1066,95 @@ class AlertSystem:
     
     def __init__(self, messenger: TelegramMessenger):
         self.messenger = messenger
-        self.scraper: Optional[VisaSlotsScraper] = None
-
-    async def run_alert_loop(self, chat_id: int):
-        """Main alert loop for monitoring slots"""
-        preferences = await user_manager.get_preferences(chat_id)
-        logger.info(f"🚀 Starting alert loop for chat_id: {chat_id}")
-        
-        await self.messenger.send_message(
+        self._background_tasks: Set[asyncio.Task] = set()
+        self._check_semaphore = asyncio.Semaphore(MAX_CONCURRENT_CHECKS)
+
+    def _spawn(self, coro) -> asyncio.Task:
+        """Run a coroutine in the background, keeping a reference until it finishes"""
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+
+    async def close(self):
+        """Cancel the poller and any running checks, waiting for them to stop"""
+        tasks = list(self._background_tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def start_alerts(self, chat_id: int, interval: int):
+        """Register user with the shared poller, starting it if needed"""
+        was_running = user_manager.subscribe(
             chat_id,
-            "✅ *Monitoring Started!*\n\n"
-            "🔍 Checking for slots...\n"
-            "💡 _No login or OTP needed!_",
-            parse_mode="Markdown"
+            interval,
+            lambda: self._spawn(self.run_poll_loop())
         )
+        if not was_running:
+            # Check right away instead of waiting for the poller's next tick
+            self._spawn(self._notify(chat_id))
+
+    async def run_poll_loop(self):
+        """Shared timer that sleeps until the next user is due and checks them"""
+        logger.info("🚀 Starting alert poller")
         
-        async with VisaSlotsScraper() as scraper:
-            self.scraper = scraper
-            
+        try:
+            while True:
+                user_manager.schedule_changed.clear()
+                due = user_manager.next_due()
+                timeout = None if due is None else max(0.0, due - time.monotonic())
+                try:
+                    # Wake early if a user joins or changes their interval
+                    await asyncio.wait_for(user_manager.schedule_changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                
+                chat_ids = user_manager.pop_due(time.monotonic())
+                if not chat_ids:
+                    continue
+                
+                # Every user due now shares one fetch
+                all_slots = await slot_cache.get(max_age=POLL_TICK / 2)
+                # Chats run concurrently, each awaiting its own sends in order.
+                # Waiting for the round keeps a slow one from piling up tasks.
+                await asyncio.gather(
+                    *(self._notify(chat_id, all_slots) for chat_id in chat_ids),
+                    return_exceptions=True
+                )
+                
+        except asyncio.CancelledError:
+            logger.info("🛑 Alert poller cancelled")
+            raise
+        finally:
+            user_manager.remove_poll_task(asyncio.current_task())
+
+    async def _notify(self, chat_id: int, all_slots: Optional[List[VisaSlot]] = None):
+        """Run one slot check for a user, reporting failures to them"""
+        preferences = user_manager.get_preferences(chat_id)
+        # Large rounds and bursts of /start_alerts queue here instead of
+        # all holding filtered results and pending sends at once
+        async with self._check_semaphore:
             try:
-                while True:
-                    try:
-                        await self._check_slots(chat_id, preferences)
-                    except Exception as e:
-                        logger.error(f"❌ Error in slot check: {e}", exc_info=True)
-                        await self.messenger.send_message(
-                            chat_id,
-                            f"⚠️ *Error checking slots*\n\n"
-                            f"Will retry in {preferences.interval // 60} min.\n\n"
-                            f"_Error: {str(e)[:100]}_",
-                            parse_mode="Markdown"
-                        )
-                    
-                    logger.info(f"⏰ Waiting {preferences.interval}s until next check")
-                    await asyncio.sleep(preferences.interval)
-                    
-            except asyncio.CancelledError:
-                logger.info(f"🛑 Alert loop cancelled for chat_id: {chat_id}")
+                if all_slots is None:
+                    all_slots = await slot_cache.get(max_age=POLL_TICK / 2)
+                await self._check_slots(chat_id, preferences, all_slots)
+            except Exception as e:
+                logger.error(f"❌ Error in slot check: {e}", exc_info=True)
                 await self.messenger.send_message(
                     chat_id,
-                    "🛑 *Monitoring Stopped*",
+                    f"⚠️ *Error checking slots*\n\n"
+                    f"Will retry in {preferences.interval // 60} min.\n\n"
+                    f"_Error: {str(e)[:100]}_",
                     parse_mode="Markdown"
                 )
-                raise
-            finally:
-                await user_manager.remove_alert_task(chat_id)
 
-    async def _check_slots(self, chat_id: int, preferences: UserPreferences):
+    async def _check_slots(
+        self,
+        chat_id: int,
+        preferences: UserPreferences,
+        all_slots: List[VisaSlot]
+    ):
         """Check for available slots and send alerts"""
-        all_slots = await self.scraper.fetch_slots()
-        
         if not all_slots:
             logger.warning("⚠️ No slots data retrieved")
             if not preferences.no_slot_alert_sent:
@@ -651,25 +1166,33 @@ class AlertSystem:
                     parse_mode="Markdown"
                 )
                 preferences.no_slot_alert_sent = True
+                user_manager.mark_dirty()
             return
 
         matching_open, other_open = SlotFilter.filter_slots(all_slots, preferences)
 
         if matching_open:
-            preferences.no_slot_alert_sent = False
+            if preferences.no_slot_alert_sent:
+                preferences.no_slot_alert_sent = False
+                user_manager.mark_dirty()
             logger.info(f"✅ Found {len(matching_open)} matching slots")
             
+            alerts = []
             for slot in matching_open:
-                slot_key = f"{slot.location}_{slot.earliest_date}"
-                is_new = slot_key not in preferences.last_notified_slots
+                fingerprint = slot_fingerprint(slot)
+                is_new = fingerprint not in preferences.last_notified_slots
                 
-                await self.messenger.send_slot_alert(chat_id, slot, is_new)
+                alerts.append((slot, is_new))
                 
                 if is_new:
-                    preferences.last_notified_slots.append(slot_key)
-                    preferences.last_notified_slots = preferences.last_notified_slots[-50:]
-                
-                await asyncio.sleep(RATE_LIMIT_DELAY)
+                    notified = preferences.last_notified_slots
+                    notified[fingerprint] = None
+                    if len(notified) > MAX_NOTIFIED_SLOTS:
+                        notified.popitem(last=False)
+                    user_manager.mark_dirty()
+            
+            # One message per check instead of one per slot
+            await self.messenger.send_slot_alert(chat_id, alerts)
                 
         elif other_open:
             await self._send_alternative_locations(chat_id, other_open, preferences)
@@ -693,15 +1216,18 @@ class AlertSystem:
         
         for slot in other_slots[:5]:
             summary_lines.append(
-                f"• {slot.location}\n"
-                f"  📅 {slot.earliest_date} | 🟢 {slot.slots_available} slots"
+                f"• {escape_markdown_v2(slot.location)}\n"
+                f"  📅 {escape_markdown_v2(slot.earliest_date)} \\| "
+                f"🟢 {escape_markdown_v2(slot.slots_available)} slots"
             )
         
         if len(other_slots) > 5:
-            summary_lines.append(f"\n_...and {len(other_slots) - 5} more_")
+            summary_lines.append(f"\n_\\.\\.\\.and {len(other_slots) - 5} more_")
         
-        await self.messenger.send_message(chat_id, "\n".join(summary_lines), parse_mode="Markdown")
-        preferences.no_slot_alert_sent = True
+        # Only stop retrying the summary once Telegram has accepted it
+        if await self.messenger.send_message(chat_id, "\n".join(summary_lines), parse_mode="MarkdownV2"):
+            preferences.no_slot_alert_sent = True
+            user_manager.mark_dirty()
 
     async def _send_no_slots_message(self, chat_id: int, preferences: UserPreferences):
         """Send message when no slots found"""
@@ -713,72 +1239,86 @@ class AlertSystem:
                 parse_mode="Markdown"
             )
             preferences.no_slot_alert_sent = True
+            user_manager.mark_dirty()
+
+
+# Shared by all users, built in main() around the application's bot
+alert_system: Optional[AlertSystem] = None
 
 
 # =============================================================================
 # COMMAND HANDLERS
 # =============================================================================
 
+# Static replies are built once at import, /status only fills in its fields
+WELCOME_MESSAGE = (
+    "🤖 *Visa Slot Alert Bot*\n\n"
+    "✅ NO LOGIN REQUIRED\n"
+    "✅ NO OTP NEEDED\n"
+    "✅ PUBLIC DATA ONLY\n\n"
+    "*Setup (3 steps):*\n"
+    "1️⃣ /set\\_visa - Choose visa type\n"
+    "2️⃣ /set\\_consulate - Choose location\n"
+    "3️⃣ /start\\_alerts - Start monitoring\n\n"
+    "*Other commands:*\n"
+    "/status - View settings\n"
+    "/stop - Stop monitoring\n"
+    "/help - Show help"
+)
+
+HELP_TEXT = (
+    "📖 *Help & FAQ*\n\n"
+    "*Q: Do I need to login?*\n"
+    "A: No! This bot scrapes public data.\n\n"
+    "*Q: Why no OTP?*\n"
+    "A: We use publicly available information.\n\n"
+    "*Q: How often does it check?*\n"
+    "A: You choose (1-60 min intervals)\n\n"
+    "*Setup:*\n"
+    "1. /set\\_visa\n"
+    "2. /set\\_consulate\n"
+    "3. /set\\_interval\n"
+    "4. /start\\_alerts"
+)
+
+STATUS_TEMPLATE = (
+    "📊 *Status Report*\n\n"
+    "Status: {status}\n\n"
+    "*Settings:*\n"
+    "{summary}\n\n"
+    "*Stats:*\n"
+    "• Slots notified: {notified}\n"
+    "• Auth required: ❌ None!\n\n"
+    "_Last updated: {time}_"
+).format
+
+
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /start command"""
     chat_id = update.effective_chat.id
-    await user_manager.get_preferences(chat_id)
-    
-    welcome_message = (
-        "🤖 *Visa Slot Alert Bot*\n\n"
-        "✅ NO LOGIN REQUIRED\n"
-        "✅ NO OTP NEEDED\n"
-        "✅ PUBLIC DATA ONLY\n\n"
-        "*Setup (3 steps):*\n"
-        "1️⃣ /set\\_visa - Choose visa type\n"
-        "2️⃣ /set\\_consulate - Choose location\n"
-        "3️⃣ /start\\_alerts - Start monitoring\n\n"
-        "*Other commands:*\n"
-        "/status - View settings\n"
-        "/stop - Stop monitoring\n"
-        "/help - Show help"
-    )
+    user_manager.get_preferences(chat_id)
     
-    await update.message.reply_text(welcome_message, parse_mode="Markdown")
+    await update.message.reply_text(WELCOME_MESSAGE, parse_mode="Markdown")
 
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /help command"""
-    help_text = (
-        "📖 *Help & FAQ*\n\n"
-        "*Q: Do I need to login?*\n"
-        "A: No! This bot scrapes public data.\n\n"
-        "*Q: Why no OTP?*\n"
-        "A: We use publicly available information.\n\n"
-        "*Q: How often does it check?*\n"
-        "A: You choose (1-60 min intervals)\n\n"
-        "*Setup:*\n"
-        "1. /set\\_visa\n"
-        "2. /set\\_consulate\n"
-        "3. /set\\_interval\n"
-        "4. /start\\_alerts"
-    )
-    
-    await update.message.reply_text(help_text, parse_mode="Markdown")
+    await update.message.reply_text(HELP_TEXT, parse_mode="Markdown")
 
 
 async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /status command"""
     chat_id = update.effective_chat.id
-    preferences = await user_manager.get_preferences(chat_id)
-    is_running = await user_manager.is_running(chat_id)
+    preferences = user_manager.get_preferences(chat_id)
+    is_running = user_manager.is_running(chat_id)
     
     status_emoji = "🟢 Active" if is_running else "🔴 Stopped"
     
-    message = (
-        f"📊 *Status Report*\n\n"
-        f"Status: {status_emoji}\n\n"
-        f"*Settings:*\n"
-        f"{preferences.get_summary()}\n\n"
-        f"*Stats:*\n"
-        f"• Slots notified: {len(preferences.last_notified_slots)}\n"
-        f"• Auth required: ❌ None!\n\n"
-        f"_Last updated: {datetime.now().strftime('%H:%M:%S')}_"
+    message = STATUS_TEMPLATE(
+        status=status_emoji,
+        summary=preferences.get_summary(),
+        notified=len(preferences.last_notified_slots),
+        time=datetime.now().strftime('%H:%M:%S')
     )
     
     await update.message.reply_text(message, parse_mode="Markdown")
@@ -786,42 +1326,27 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def set_visa_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /set_visa command"""
-    keyboard = [
-        [InlineKeyboardButton(visa, callback_data=f"visa_{visa}")]
-        for visa in VISA_TYPES
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text(
         "📋 *Select Visa Type:*",
-        reply_markup=reply_markup,
+        reply_markup=VISA_KEYBOARD,
         parse_mode="Markdown"
     )
 
 
 async def set_consulate_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /set_consulate command"""
-    keyboard = [
-        [InlineKeyboardButton(city, callback_data=f"city_{city}")]
-        for city in CITIES
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text(
         "🏛️ *Select Consulate City:*",
-        reply_markup=reply_markup,
+        reply_markup=CITY_KEYBOARD,
         parse_mode="Markdown"
     )
 
 
 async def set_interval_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /set_interval command"""
-    keyboard = [
-        [InlineKeyboardButton(interval, callback_data=f"interval_{interval}")]
-        for interval in INTERVALS.keys()
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text(
         "⏰ *Select Check Interval:*",
-        reply_markup=reply_markup,
+        reply_markup=INTERVAL_KEYBOARD,
         parse_mode="Markdown"
     )
 
@@ -836,7 +1361,7 @@ async def start_alerts_command(update: Update, context: ContextTypes.DEFAULT_TYP
         message = update.message
         chat_id = update.effective_chat.id
 
-    preferences = await user_manager.get_preferences(chat_id)
+    preferences = user_manager.get_preferences(chat_id)
 
     if not preferences.is_complete():
         await message.reply_text(
@@ -849,7 +1374,7 @@ async def start_alerts_command(update: Update, context: ContextTypes.DEFAULT_TYP
         )
         return
 
-    if await user_manager.is_running(chat_id):
+    if user_manager.is_running(chat_id):
         await message.reply_text("⚠️ Already monitoring!")
         return
 
@@ -861,24 +1386,14 @@ async def start_alerts_command(update: Update, context: ContextTypes.DEFAULT_TYP
     )
     await message.reply_text(summary, parse_mode="Markdown")
 
-    messenger = TelegramMessenger(BOT_TOKEN)
-    alert_system = AlertSystem(messenger)
-    task = asyncio.create_task(alert_system.run_alert_loop(chat_id))
-    await user_manager.set_alert_task(chat_id, task)
+    alert_system.start_alerts(chat_id, preferences.interval)
 
 
 async def stop_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /stop command"""
     chat_id = update.effective_chat.id
-    task = await user_manager.get_alert_task(chat_id)
     
-    if task and not task.done():
-        task.cancel()
-        try:
-            await task
-        except asyncio.CancelledError:
-            pass
-        await user_manager.remove_alert_task(chat_id)
+    if user_manager.unsubscribe(chat_id):
         await update.message.reply_text(
             "🛑 *Monitoring Stopped*\n\n"
             "Use /start\\_alerts to resume",
@@ -892,67 +1407,81 @@ async def stop_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # CALLBACK HANDLERS
 # =============================================================================
 
+async def handle_visa_selection(query, preferences: UserPreferences, value: str):
+    """Handle visa type selection"""
+    preferences.visa_type = value
+    await query.message.reply_text(f"✅ Visa: {preferences.visa_type}")
+    await query.message.reply_text("🏛️ *Select City:*", reply_markup=CITY_KEYBOARD, parse_mode="Markdown")
+
+
+async def handle_city_selection(query, preferences: UserPreferences, value: str):
+    """Handle consulate city selection"""
+    preferences.consulate_city = value
+    await query.message.reply_text(f"✅ City: {preferences.consulate_city}")
+    await query.message.reply_text("🏢 *Select Type:*", reply_markup=CONSULATE_TYPE_KEYBOARD, parse_mode="Markdown")
+
+
+async def handle_type_selection(query, preferences: UserPreferences, value: str):
+    """Handle consulate type selection"""
+    preferences.consulate_type = value
+    await query.message.reply_text(f"✅ Type: {preferences.consulate_type}")
+    await query.message.reply_text("📅 *Year Filter:*", reply_markup=YEAR_KEYBOARD, parse_mode="Markdown")
+
+
+async def handle_year_selection(query, preferences: UserPreferences, value: str):
+    """Handle year filter selection"""
+    preferences.year_filter = None if value == "No Filter" else [value]
+    await query.message.reply_text(f"✅ Year: {value}")
+    await query.message.reply_text("⏰ *Check Interval:*", reply_markup=INTERVAL_KEYBOARD, parse_mode="Markdown")
+
+
+async def handle_interval_selection(query, preferences: UserPreferences, value: str):
+    """Handle check interval selection"""
+    preferences.interval = INTERVALS[value]
+    await query.message.reply_text(f"✅ Interval: {value}")
+    
+    chat_id = query.message.chat_id
+    if user_manager.is_running(chat_id):
+        # Move running alerts to the new interval's timer
+        alert_system.start_alerts(chat_id, preferences.interval)
+    
+    summary = (
+        "🎯 *Setup Complete!*\n\n"
+        f"{preferences.get_summary()}\n\n"
+        "✅ No authentication required!"
+    )
+    
+    await query.message.reply_text(summary, parse_mode="Markdown")
+    await query.message.reply_text("Ready to start:", reply_markup=START_KEYBOARD)
+
+
+# Callback data prefix (before the first "_") -> selection handler
+SELECTION_HANDLERS = {
+    "visa": handle_visa_selection,
+    "city": handle_city_selection,
+    "type": handle_type_selection,
+    "year": handle_year_selection,
+    "interval": handle_interval_selection
+}
+
+
 async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle all callback queries"""
     query = update.callback_query
-    await query.answer()
-    
-    chat_id = update.effective_chat.id
-    preferences = await user_manager.get_preferences(chat_id)
     data = query.data
-
-    if data.startswith("visa_"):
-        preferences.visa_type = data.replace("visa_", "")
-        await query.message.reply_text(f"✅ Visa: {preferences.visa_type}")
-        
-        keyboard = [[InlineKeyboardButton(city, callback_data=f"city_{city}")] for city in CITIES]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.message.reply_text("🏛️ *Select City:*", reply_markup=reply_markup, parse_mode="Markdown")
-        
-    elif data.startswith("city_"):
-        preferences.consulate_city = data.replace("city_", "")
-        await query.message.reply_text(f"✅ City: {preferences.consulate_city}")
-        
-        keyboard = [[InlineKeyboardButton(t, callback_data=f"type_{t}")] for t in CONSULATE_TYPES]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.message.reply_text("🏢 *Select Type:*", reply_markup=reply_markup, parse_mode="Markdown")
-        
-    elif data.startswith("type_"):
-        preferences.consulate_type = data.replace("type_", "")
-        await query.message.reply_text(f"✅ Type: {preferences.consulate_type}")
-        
-        keyboard = [[InlineKeyboardButton(y, callback_data=f"year_{y}")] for y in YEAR_OPTIONS]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.message.reply_text("📅 *Year Filter:*", reply_markup=reply_markup, parse_mode="Markdown")
-        
-    elif data.startswith("year_"):
-        selection = data.replace("year_", "")
-        preferences.year_filter = None if selection == "No Filter" else [selection]
-        await query.message.reply_text(f"✅ Year: {selection}")
-        
-        keyboard = [[InlineKeyboardButton(i, callback_data=f"interval_{i}")] for i in INTERVALS.keys()]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.message.reply_text("⏰ *Check Interval:*", reply_markup=reply_markup, parse_mode="Markdown")
-        
-    elif data.startswith("interval_"):
-        interval_key = data.replace("interval_", "")
-        preferences.interval = INTERVALS[interval_key]
-        await query.message.reply_text(f"✅ Interval: {interval_key}")
-        
-        summary = (
-            "🎯 *Setup Complete!*\n\n"
-            f"{preferences.get_summary()}\n\n"
-            "✅ No authentication required!"
-        )
-        
-        keyboard = [[InlineKeyboardButton("🚀 Start Monitoring", callback_data="start_alerts")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.message.reply_text(summary, parse_mode="Markdown")
-        await query.message.reply_text("Ready to start:", reply_markup=reply_markup)
-        
-    elif data == "start_alerts":
+    
+    if data == "start_alerts":
+        # start_alerts_command answers the query itself
         await start_alerts_command(update, context)
+        return
+    
+    await query.answer()
+    prefix, _, value = data.partition("_")
+    handler = SELECTION_HANDLERS.get(prefix)
+    if handler:
+        preferences = user_manager.get_preferences(update.effective_chat.id)
+        await handler(query, preferences, value)
+        user_manager.mark_dirty()
 
 
 # =============================================================================
@@ -971,12 +1500,39 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
+# =============================================================================
+# LIFECYCLE
+# =============================================================================
+
+async def post_init(application: Application):
+    """Open shared resources once the application is initialized"""
+    global SHARED_SESSION
+    SHARED_SESSION = build_http_session()
+    slot_cache.scraper = VisaSlotsScraper(session=SHARED_SESSION)
+    logger.info("🌐 Shared HTTP session opened")
+    user_manager.start_flushing()
+
+
+async def post_shutdown(application: Application):
+    """Close shared resources on shutdown"""
+    # Stop checks first so none marks data dirty after the final save
+    # or fetches through the closed session
+    if alert_system:
+        await alert_system.close()
+    await user_manager.close()
+    if SHARED_SESSION and not SHARED_SESSION.closed:
+        await SHARED_SESSION.close()
+        logger.info("🌐 Shared HTTP session closed")
+    PARSE_EXECUTOR.shutdown(wait=False, cancel_futures=True)
+
+
 # =============================================================================
 # MAIN
 # =============================================================================
 
 def main():
     """Main entry point"""
+    log_listener.start()
     logger.info("=" * 60)
     logger.info("🤖 Visa Slot Alert Bot - Starting")
     logger.info("=" * 60)
@@ -984,7 +1540,23 @@ def main():
     if not validate_environment():
         sys.exit(1)
     
-    app = Application.builder().token(BOT_TOKEN).build()
+    if uvloop is not None:
+        # Must be installed before the application creates its loop
+        uvloop.install()
+        logger.info("⚡ Using uvloop event loop")
+    
+    app = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .pool_timeout(TELEGRAM_POOL_TIMEOUT)
+        .get_updates_pool_timeout(GET_UPDATES_POOL_TIMEOUT)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+    
+    global alert_system
+    alert_system = AlertSystem(TelegramMessenger(app.bot))
     
     # Commands
     app.add_handler(CommandHandler("start", start_command))
@@ -1003,7 +1575,20 @@ def main():
     app.add_error_handler(error_handler)
     
     logger.info("✅ Bot ready - NO OTP REQUIRED!")
-    app.run_polling(allowed_updates=Update.ALL_TYPES)
+    if WEBHOOK_URL:
+        # Updates arrive as they happen and are acked before handlers run,
+        # with no getUpdates round trips
+        logger.info(f"🪝 Receiving updates by webhook on port {WEBHOOK_PORT}")
+        app.run_webhook(
+            listen="0.0.0.0",
+            port=WEBHOOK_PORT,
+            url_path=urlparse(WEBHOOK_URL).path.lstrip("/"),
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES
+        )
+    else:
+        app.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == "__main__":
@@ -1013,4 +1598,7 @@ if __name__ == "__main__":
         logger.info("🛑 Stopped by user")
     except Exception as e:
         logger.critical(f"💥 Critical error: {e}", exc_info=True)
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
+    finally:
+        # Flush queued records before the process exits
+        log_listener.stop()
\ No newline at end of file